@@ -7,16 +7,81 @@ It requires Tesseract OCR to be installed on your system.
 """
 
 import argparse
+import collections
+import contextlib
+import functools
+import gc
+import hashlib
+import multiprocessing
 import os
+import queue
+import re
+import site
 import sys
 import subprocess
+import tempfile
+import threading
+import time
 import venv
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 
+_VENV_DIR = Path.home() / ".pdf_extractor_venv"
+
+# Written to the virtual environment once its packages are installed
+_VENV_MARKER = ".installed-v1"
+
+# Pixels brighter than this after contrast enhancement become white, the rest
+# black
+_THRESHOLD = 150
+
+# Maximum number of pages OCR'd by a single Tesseract invocation
+_OCR_BATCH_SIZE = 8
+
+# Seconds Tesseract may spend on a single page before it is given up on
+_PAGE_TIMEOUT = 60
+
+# Pages with more embedded text than this are not OCR'd
+_MIN_TEXT_LAYER_CHARS = 50
+
+# Maximum number of pages waiting between extraction pipeline stages
+_QUEUE_SIZE = 4
+
+# Seconds between checks for finished or overdue OCR batches
+_POLL_INTERVAL = 0.1
+
+# Written after each page of the combined document as a page break marker for
+# Word/Google Docs
+_PAGE_SEPARATOR = b"\n\n" + b"-" * 80 + b"\n\n"
+
+# Written to the output directory to record which PDF its pages came from,
+# and how they were extracted
+_SOURCE_MARKER = ".source"
+
+# Name of the combined document written to the output directory
+_COMBINED_FILE = "combined_text.txt"
+
+# Maximum number of pages held in memory while they wait for earlier pages to
+# be written to the combined document
+_MAX_WAITING_PAGES = 32
+
+# Per-page text files written by extract_text_from_pdf
+_PAGE_FILE_RE = re.compile(r"page_(\d+)\.txt$")
+
+# Left behind by _write_page if a run is interrupted mid-write
+_PAGE_TMP_FILE_RE = re.compile(r"page_\d+\.txt\.tmp$")
+
+
 def setup_virtual_environment():
-    """Set up a virtual environment for the required packages."""
-    venv_dir = Path.home() / ".pdf_extractor_venv"
+    """Set up a virtual environment for the required packages.
+    
+    Packages are only installed the first time, or when the list of packages
+    changes; later runs find the install marker and skip pip entirely.
+    """
+    venv_dir = _VENV_DIR
     
     # Create virtual environment if it doesn't exist
     if not venv_dir.exists():
@@ -34,6 +99,16 @@ def setup_virtual_environment():
     # Required packages
     packages = ["pdf2image", "pytesseract", "pillow"]
     
+    # Optional packages speed up extraction but need system libraries that may
+    # not be available, so failing to install them is not an error
+    optional_packages = ["tesserocr", "numba"]
+    
+    # Skip installation if these packages were already installed
+    marker = venv_dir / _VENV_MARKER
+    installed = " ".join(packages + optional_packages)
+    if marker.exists() and marker.read_text(encoding="utf-8") == installed:
+        return python_path
+    
     print(f"Installing required packages in virtual environment: {', '.join(packages)}")
     
     try:
@@ -44,9 +119,38 @@ def setup_virtual_environment():
         print("Please install them manually in the virtual environment.")
         sys.exit(1)
     
+    for package in optional_packages:
+        try:
+            subprocess.check_call([str(pip_path), "install", package])
+        except Exception as e:
+            print(f"Could not install optional package {package}: {e}")
+            print("Continuing without it.")
+    
+    marker.write_text(installed, encoding="utf-8")
     return python_path
 
 
+@functools.lru_cache(maxsize=1)
+def _add_venv_site_packages():
+    """Make the packages installed in the virtual environment importable.
+    
+    Uses site.addsitedir so any .pth files are processed, then moves the new
+    entries to the front of sys.path so the virtual environment's packages
+    take precedence over system-wide ones.
+    """
+    if sys.platform == 'win32':
+        site_packages = _VENV_DIR / 'Lib' / 'site-packages'
+    else:
+        site_packages = (_VENV_DIR / 'lib' /
+                         f"python{sys.version_info.major}.{sys.version_info.minor}" /
+                         'site-packages')
+    
+    original_path = list(sys.path)
+    site.addsitedir(str(site_packages))
+    added = [entry for entry in sys.path if entry not in original_path]
+    sys.path[:] = added + original_path
+
+
 def check_tesseract():
     """Check if Tesseract OCR is installed."""
     try:
@@ -64,60 +168,684 @@ def check_tesseract():
         return False
 
 
-def extract_text_from_pdf(pdf_path, output_dir):
+# In-process Tesseract API held by each OCR worker, if tesserocr is available
+_tess_api = None
+
+
+def _init_ocr_worker(tesserocr_failed):
+    """Prepare a worker process for OCR.
+
+    Limits Tesseract to a single OpenMP thread: pages are already OCR'd in
+    parallel across processes, so letting every Tesseract instance spin up its
+    own thread pool only oversubscribes the CPU. If tesserocr is installed, a
+    single Tesseract API is created here and reused for every page the worker
+    processes, so the language model is loaded once per worker.
+
+    If tesserocr cannot start Tesseract, the worker falls back to the
+    tesseract command. ``tesserocr_failed`` is a shared flag that makes sure
+    only the first worker to fail reports it.
+    """
+    global _tess_api
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    try:
+        from tesserocr import PyTessBaseAPI
+    except ImportError:
+        return
+    try:
+        _tess_api = PyTessBaseAPI()
+    except RuntimeError as e:
+        # Most often tesserocr could not find Tesseract's language data
+        with tesserocr_failed.get_lock():
+            if not tesserocr_failed.value:
+                tesserocr_failed.value = True
+                print(f"Could not start tesserocr, using the tesseract command instead: {e}")
+
+
+def _ocr_batch_size(page_count, workers):
+    """Pick a batch size that amortizes model loading but keeps all workers busy."""
+    return max(1, min(_OCR_BATCH_SIZE, -(-page_count // workers)))
+
+
+@functools.lru_cache(maxsize=1)
+def _numba_preprocess_kernel():
+    """Compile the fused preprocessing kernel with Numba, if it is installed.
+
+    The kernel sums a grayscale page for its mean, then thresholds it into a
+    boolean mask, parallelizing both loops over rows. It is cached on disk, so
+    it is only compiled on the first run. Returns None if Numba is not
+    available.
+    """
+    try:
+        import numba
+    except ImportError:
+        return None
+
+    # The kernel runs in a pipeline thread, and the TBB threading layer hangs
+    # the interpreter on exit when used from one; workqueue has no such issue
+    numba.config.THREADING_LAYER = 'workqueue'
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def kernel(gray, out):
+        height, width = gray.shape
+        total = 0
+        for y in numba.prange(height):
+            row_total = 0
+            for x in range(width):
+                row_total += gray[y, x]
+            total += row_total
+
+        mean = int(total / (height * width) + 0.5)
+        threshold = (_THRESHOLD + mean) // 2
+        for y in numba.prange(height):
+            for x in range(width):
+                out[y, x] = gray[y, x] > threshold
+
+    return kernel
+
+
+@functools.lru_cache(maxsize=256)
+def _contrast_threshold_lut(mean):
+    """Build a lookup table that boosts contrast 2x around mean, then thresholds.
+
+    Both steps are pointwise on 0-255, so they collapse into a single table.
+    There is only one table per possible mean, so each is built at most once.
+    """
+    return bytes(255 if max(0, min(255, 2 * i - mean)) > _THRESHOLD else 0
+                 for i in range(256))
+
+
+def _preprocess_image(image, buffers):
+    """Convert a grayscale page into a high-contrast 1-bit image.
+
+    A 2x contrast boost and thresholding are fused into as few passes as
+    possible: a single parallel Numba kernel if Numba is installed, otherwise
+    one lookup table pass in Pillow. The result is a 1-bit image, which
+    Tesseract takes as already binarized.
+
+    ``buffers`` is a dict of output arrays, keyed by page shape, for the Numba
+    kernel to reuse across pages.
+
+    Any intermediate image is closed before returning; closing ``image`` and
+    the returned image is left to the caller.
+    """
+    # Pages are normally rendered in grayscale already
+    if image.mode != 'L':
+        with image.convert('L') as gray_image:
+            return _preprocess_image(gray_image, buffers)
+
+    kernel = _numba_preprocess_kernel()
+    if kernel is not None:
+        import numpy as np
+        from PIL import Image
+
+        gray = np.asarray(image)
+        if gray.shape not in buffers:
+            buffers[gray.shape] = np.empty(gray.shape, dtype=np.bool_)
+        out = buffers[gray.shape]
+        kernel(gray, out)
+        del gray
+        return Image.fromarray(out)
+
+    # Increase contrast around the mean, as ImageEnhance.Contrast does, and
+    # apply threshold to make text more distinct
+    histogram = image.histogram()
+    mean = int(sum(i * count for i, count in enumerate(histogram)) / sum(histogram) + 0.5)
+    return image.point(_contrast_threshold_lut(mean), '1')
+
+
+def _split_pages(output, page_count):
+    """Split the output of tesseract or pdftotext back into pages.
+
+    Returns a list of the text of each page, or None if the output does not
+    contain exactly page_count pages.
+    """
+    # Each page is followed by a form feed, leaving an empty trailing chunk
+    texts = output.decode("utf-8", errors="replace").split("\f")
+    if len(texts) != page_count + 1:
+        return None
+    return texts[:-1]
+
+
+def _run_tesseract_batch(image_paths, list_file):
+    """OCR several images with a single Tesseract process.
+
+    Tesseract accepts a text file listing one image per line, which means the
+    language model is only loaded once for the whole batch. Returns the text of
+    each image in order, or None if Tesseract failed, timed out or its output
+    could not be split back into pages.
+    """
+    with open(list_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(str(path) for path in image_paths) + "\n")
+
+    try:
+        result = subprocess.run(["tesseract", str(list_file), "stdout",
+                                 "-c", "include_page_breaks=1",
+                                 "-c", "page_separator=\f"],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                timeout=_PAGE_TIMEOUT * len(image_paths),
+                                check=True)
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return None
+
+    return _split_pages(result.stdout, len(image_paths))
+
+
+def _page_file(output_dir, page_num):
+    """Return the path of the text file for a page."""
+    return Path(output_dir) / f"page_{page_num:03d}.txt"
+
+
+def _write_page(output_dir, page_num, text):
+    """Save the text of one page and return the path of the file written.
+    
+    The text is written to a temporary file that is then renamed into place,
+    so an interrupted run never leaves a truncated page file behind for
+    resume to treat as done.
+    """
+    output_file = _page_file(output_dir, page_num)
+    tmp_file = output_file.with_suffix(".txt.tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(text.encode("utf-8"))
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+def _ocr_page_batch(pages):
+    """OCR a batch of preprocessed pages in a worker process.
+
+    Takes a list of ``(page_num, image_path)`` pairs and returns a list of
+    ``(page_num, text)`` pairs, where text is None for pages that Tesseract
+    could not finish within the time limit. The page images are deleted once
+    they are OCR'd.
+    """
+    import pytesseract
+    from PIL import Image
+
+    page_nums = [page_num for page_num, _ in pages]
+    image_paths = [image_path for _, image_path in pages]
+    print(f"Processing pages {', '.join(str(page_num) for page_num in page_nums)}")
+
+    # Extract text using OCR, in process if possible, otherwise with one
+    # Tesseract run for the whole batch or, failing that, one run per page
+    if _tess_api is not None:
+        texts = []
+        for page_num, image_path in pages:
+            _tess_api.SetImageFile(str(image_path))
+            if _tess_api.Recognize(timeout=_PAGE_TIMEOUT * 1000):
+                texts.append(_tess_api.GetUTF8Text())
+            else:
+                print(f"Error extracting text from page {page_num}: Tesseract timed out")
+                texts.append(None)
+    else:
+        list_file = Path(image_paths[0]).with_suffix(".list")
+        texts = _run_tesseract_batch(image_paths, list_file)
+        os.remove(list_file)
+    if texts is None:
+        texts = []
+        for page_num, image_path in pages:
+            with Image.open(image_path) as image:
+                try:
+                    text = pytesseract.image_to_string(image, timeout=_PAGE_TIMEOUT)
+                except RuntimeError as e:
+                    # pytesseract reports a timed out Tesseract as a RuntimeError
+                    print(f"Error extracting text from page {page_num}: {e}")
+                    text = None
+            texts.append(text)
+
+    for image_path in image_paths:
+        os.remove(image_path)
+
+    return list(zip(page_nums, texts))
+
+
+def _source_digest(pdf_path):
+    """Return a short hash of the contents of a PDF file."""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pages_to_extract(pdf_path, output_dir, page_count, use_text_layer):
+    """Work out which pages of a PDF still need to be extracted.
+    
+    If the output directory was last used for the same PDF, extracted the
+    same way, pages that already have a text file are skipped, so an
+    interrupted run can be resumed. Otherwise any page files left over from
+    another PDF, or from a run with or without --force-ocr, are deleted so
+    they can never be mistaken for pages of this one. The PDF's hash and
+    whether the text layer was used are then recorded in the output
+    directory for the next run to check. Partly written page files are
+    deleted either way.
+    """
+    marker = output_dir / _SOURCE_MARKER
+    digest = _source_digest(pdf_path)
+    if not use_text_layer:
+        digest += " force-ocr"
+    resume = marker.exists() and marker.read_text(encoding="utf-8") == digest
+    
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if _PAGE_TMP_FILE_RE.match(entry.name) or (
+                    not resume and _PAGE_FILE_RE.match(entry.name)):
+                os.remove(entry.path)
+    
+    pages = range(1, page_count + 1)
+    if not resume:
+        marker.write_text(digest, encoding="utf-8")
+        return list(pages)
+    
+    return [page_num for page_num in pages
+            if not _page_file(output_dir, page_num).exists()]
+
+
+def _text_layer_pages(pdf_path, page_count):
+    """Read the embedded text layer of a PDF with pdftotext.
+    
+    pdftotext ships with Poppler alongside the tools pdf2image relies on.
+    Returns a dict mapping page numbers to their text, containing only pages
+    with enough text to be worth using. Returns an empty dict if pdftotext is
+    not available or its output could not be split back into pages.
+    """
+    try:
+        result = subprocess.run(["pdftotext", "-enc", "UTF-8", str(pdf_path), "-"],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                check=True)
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return {}
+    
+    texts = _split_pages(result.stdout, page_count)
+    if texts is None:
+        return {}
+    return {page_num: text for page_num, text in enumerate(texts, 1)
+            if len(text.strip()) > _MIN_TEXT_LAYER_CHARS}
+
+
+def _page_ranges(page_nums, size):
+    """Group sorted page numbers into ranges of consecutive pages.
+    
+    Returns a list of ``(first_page, last_page)`` pairs covering at most
+    ``size`` pages each.
+    """
+    ranges = []
+    for page_num in page_nums:
+        if ranges:
+            first, last = ranges[-1]
+            if page_num == last + 1 and page_num - first < size:
+                ranges[-1] = (first, page_num)
+                continue
+        ranges.append((page_num, page_num))
+    return ranges
+
+
+def _start_stage(work, input_queue, output_queue, errors):
+    """Run one stage of the extraction pipeline in a background thread.
+
+    The stage always finishes by putting a ``None`` sentinel on its output
+    queue so the next stage knows to stop. If ``work`` raises, the exception is
+    recorded in ``errors`` and the input queue is drained so the previous stage
+    never blocks on a queue nobody is reading.
+    """
+    def run():
+        try:
+            work()
+        except Exception as e:
+            errors.append(e)
+            if input_queue is not None:
+                for _ in iter(input_queue.get, None):
+                    pass
+        finally:
+            output_queue.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _terminate_pool(pool):
+    """Shut down a process pool without waiting, killing any running tasks.
+    
+    ProcessPoolExecutor has no public way to stop a task once it has started,
+    so this is the only way to get rid of a worker stuck on a page.
+    """
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False)
+
+
+def _ocr_pages(pdf_path, pending, save_page):
+    """OCR the given pages of a PDF, calling ``save_page(page_num, text)`` for each.
+    
+    Extraction runs as a three stage pipeline so that rendering,
+    preprocessing and OCR all overlap:
+    
+    1. A thread renders pages, a few at a time, to temporary grayscale PNG
+       files.
+    2. A thread preprocesses each rendered page into a 1-bit image for OCR.
+    3. A pool of worker processes, one per CPU core, OCRs batches of
+       preprocessed pages. Each worker keeps Tesseract loaded in process
+       through tesserocr if it is installed, and otherwise runs a single
+       Tesseract invocation per batch.
+    
+    The stages are connected by bounded queues, so only a handful of pages
+    are waiting between stages at any time. Pages are saved as their batch
+    finishes, which is not necessarily in page order.
+    
+    Pages that Tesseract cannot finish within a time limit, and batches that
+    raise an error, are saved with None as their text so that one bad page
+    does not stop the rest of the document from being extracted. If a worker
+    process crashes, or a batch runs far past the time limit for its pages,
+    the pool is rebuilt and the unfinished pages are retried.
+    """
+    from pdf2image import convert_from_path
+    from PIL import Image
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        render_queue = queue.Queue(maxsize=_QUEUE_SIZE)
+        ocr_queue = queue.Queue(maxsize=_QUEUE_SIZE)
+        errors = []
+        
+        workers = os.cpu_count() or 1
+        
+        def render_pages():
+            # Render a worker's worth of pages per call, so the PDF is not
+            # re-parsed for every page but OCR can start before it is all done
+            for first_page, last_page in _page_ranges(pending, workers):
+                paths = convert_from_path(pdf_path, dpi=200, first_page=first_page,
+                                          last_page=last_page, output_folder=temp_dir,
+                                          paths_only=True, fmt='png', grayscale=True)
+                if len(paths) != last_page - first_page + 1:
+                    raise RuntimeError(f"Could not render pages {first_page}-{last_page}")
+                for page_num, path in zip(range(first_page, last_page + 1), paths):
+                    render_queue.put((page_num, path))
+        
+        def preprocess_pages():
+            buffers = {}
+            for count, (page_num, path) in enumerate(iter(render_queue.get, None), 1):
+                # Preprocess the image to improve OCR quality
+                ocr_path = Path(temp_dir) / f"ocr_{page_num:05d}.png"
+                with Image.open(path) as image, _preprocess_image(image, buffers) as ocr_image:
+                    ocr_image.save(ocr_path)
+                os.remove(path)
+                ocr_queue.put((page_num, ocr_path))
+                # Page images are large, so collect any that are only held by
+                # reference cycles before they pile up
+                if count % 16 == 0:
+                    gc.collect()
+        
+        print(f"Extracting text from {len(pending)} pages of {pdf_path}...")
+        threads = [_start_stage(render_pages, None, render_queue, errors),
+                   _start_stage(preprocess_pages, render_queue, ocr_queue, errors)]
+        
+        batch_size = _ocr_batch_size(len(pending), workers)
+        
+        # Spawn rather than fork workers, since the pipeline threads (and any
+        # Numba thread pool) are already running when the pool starts
+        mp_context = multiprocessing.get_context("spawn")
+        tesserocr_failed = mp_context.Value('b', False)
+        
+        def new_pool(max_workers=workers):
+            return ProcessPoolExecutor(max_workers=max_workers,
+                                       mp_context=mp_context,
+                                       initializer=_init_ocr_worker,
+                                       initargs=(tesserocr_failed,))
+        
+        pool = new_pool()
+        # Map each submitted future to its batch and the pool it was sent to
+        futures = {}
+        # Batches lost when a worker crashed, with the pool they were sent to
+        lost = []
+        # Pages lost to more than one crash, to be retried on their own
+        suspects = []
+        attempts = collections.Counter()
+        # When each future was first seen running in a worker
+        started = {}
+        
+        def describe(batch):
+            if len(batch) == 1:
+                return f"page {batch[0][0]}"
+            return "pages " + ", ".join(str(page_num) for page_num, _ in batch)
+        
+        def time_limit(batch):
+            # Workers time out pages themselves, so this only catches a worker
+            # stuck outside those limits. Allow for both the batch run and the
+            # per-page fallback timing out, with room to spare.
+            return 3 * _PAGE_TIMEOUT * len(batch)
+        
+        def submit(batch):
+            for page_num, _ in batch:
+                attempts[page_num] += 1
+            try:
+                futures[pool.submit(_ocr_page_batch, batch)] = (batch, pool)
+            except BrokenProcessPool:
+                lost.append((batch, pool))
+        
+        def resubmit_lost():
+            # A crashed worker breaks its whole pool, failing every batch that
+            # had not finished, whether or not it caused the crash. Replace the
+            # pool and resubmit those pages one at a time. Pages lost again
+            # are set aside as suspects.
+            nonlocal pool
+            if any(broken_pool is pool for _, broken_pool in lost):
+                pool.shutdown(wait=False)
+                pool = new_pool()
+            batches = [batch for batch, _ in lost]
+            lost.clear()
+            for batch in batches:
+                for page in batch:
+                    if attempts[page[0]] < 2:
+                        submit([page])
+                    else:
+                        suspects.append(page)
+        
+        def ocr_suspect(page):
+            # Run the page alone in a fresh single-worker pool, so that if the
+            # worker crashes again this page is known to be the cause
+            page_num = page[0]
+            with new_pool(max_workers=1) as solo_pool:
+                try:
+                    return solo_pool.submit(_ocr_page_batch, [page]).result(
+                        timeout=time_limit([page]))
+                except FutureTimeoutError:
+                    print(f"Error extracting text from page {page_num}: OCR timed out")
+                    _terminate_pool(solo_pool)
+                except BrokenProcessPool:
+                    print(f"Error extracting text from page {page_num}: OCR worker crashed")
+                except Exception as e:
+                    print(f"Error extracting text from page {page_num}: {e}")
+            return [(page_num, None)]
+        
+        def collect(timeout):
+            # Save the pages of batches that finish within timeout seconds
+            if lost:
+                resubmit_lost()
+            if futures:
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, submitted_to = futures.pop(future)
+                    started.pop(future, None)
+                    try:
+                        results = future.result()
+                    except BrokenProcessPool:
+                        lost.append((batch, submitted_to))
+                        continue
+                    except Exception as e:
+                        # Don't let one failed batch stop the rest of the document
+                        print(f"Error extracting text from {describe(batch)}: {e}")
+                        results = [(page_num, None) for page_num, _ in batch]
+                    for page_num, text in results:
+                        save_page(page_num, text)
+            
+            # A hung worker would otherwise block the rest of the document, so
+            # kill its pool and retry the batch as if the worker had crashed
+            now = time.monotonic()
+            running = collections.Counter()
+            for future, (batch, submitted_to) in list(futures.items()):
+                if not future.running():
+                    continue
+                # The executor marks one more batch as running than it has
+                # workers, ready for the next free one. Batches are picked up in
+                # the order they were submitted, so only time the first ones.
+                running[submitted_to] += 1
+                if running[submitted_to] > workers:
+                    continue
+                if now - started.setdefault(future, now) > time_limit(batch):
+                    print(f"Error extracting text from {describe(batch)}: OCR timed out")
+                    del futures[future]
+                    del started[future]
+                    lost.append((batch, submitted_to))
+                    _terminate_pool(submitted_to)
+        
+        try:
+            # Keep collecting finished batches while pages are still being
+            # rendered, so each page is saved as soon as its batch is done
+            batch = []
+            while True:
+                try:
+                    page = ocr_queue.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    collect(timeout=0)
+                    continue
+                if page is None:
+                    break
+                batch.append(page)
+                if len(batch) == batch_size:
+                    submit(batch)
+                    batch = []
+                collect(timeout=0)
+            if batch:
+                submit(batch)
+            
+            while futures or lost:
+                collect(timeout=_POLL_INTERVAL)
+            
+            for page in sorted(suspects):
+                for page_num, text in ocr_suspect(page):
+                    save_page(page_num, text)
+        finally:
+            pool.shutdown()
+        
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+
+def extract_text_from_pdf(pdf_path, output_dir, use_text_layer=True,
+                          combine_path=None, per_page=True):
     """Extract text from PDF using OCR.
     
+    Each page is saved to its own text file in output_dir. If combine_path is
+    given, pages are also written straight into a combined document at that
+    path as they are extracted, and per-page files are only written if
+    per_page is set.
+    
+    If use_text_layer is set, pages that already have an embedded text layer
+    are saved from it directly and only the remaining pages are OCR'd.
+    
+    Pages already extracted to output_dir from the same PDF are skipped, so
+    an interrupted extraction picks up where it left off. Pages that could not
+    be extracted get no text file, so they are tried again too. This relies on
+    the per-page files, so it does not apply when they are not written.
+    
     This function requires the following packages:
     - pdf2image: For converting PDF to images
-    - pytesseract: Python wrapper for Tesseract OCR
+    - pytesseract: Python wrapper for Tesseract OCR, used if batch OCR fails
     - pillow: For image processing
+    - tesserocr: (Optional) In-process Tesseract bindings
+    - numba: (Optional) For parallel, compiled image preprocessing
     
     These packages should be installed in the virtual environment.
     """
     # Import here to ensure these are imported from virtual environment
-    from pdf2image import convert_from_path
-    import pytesseract
-    from PIL import Image, ImageEnhance, ImageFilter
+    from pdf2image import pdfinfo_from_path
     
-    print(f"Converting PDF to images: {pdf_path}")
-    # Convert PDF to images
-    images = convert_from_path(pdf_path)
+    page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    if combine_path is None:
+        per_page = True
     
     # Create output directory if it doesn't exist
     output_dir = Path(output_dir)
     output_dir.mkdir(exist_ok=True)
     
-    print(f"Extracting text from {len(images)} pages...")
-    for i, image in enumerate(images):
-        page_num = i + 1
-        print(f"Processing page {page_num}/{len(images)}")
-        
-        # Preprocess the image to improve OCR quality
-        # Convert to grayscale
-        gray_image = image.convert('L')
+    pending = _pages_to_extract(pdf_path, output_dir, page_count, use_text_layer)
+    
+    with contextlib.ExitStack() as stack:
+        combined = stack.enter_context(open(combine_path, "wb")) if combine_path else None
+        # The combined document has to be in page order, so pages that finish
+        # early wait until every page before them has been written. Only a
+        # few wait in memory; the rest are parked in a temporary file, with
+        # their offset and size kept in spilled.
+        waiting = {}
+        spilled = {}
+        spill = None
+        next_page = 1
+        failed = []
         
-        # Increase contrast
-        enhancer = ImageEnhance.Contrast(gray_image)
-        enhanced_image = enhancer.enhance(2)
+        def combine_page(page_num, data):
+            nonlocal next_page, spill
+            if page_num != next_page and len(waiting) >= _MAX_WAITING_PAGES:
+                if spill is None:
+                    spill = stack.enter_context(tempfile.TemporaryFile())
+                spill.seek(0, os.SEEK_END)
+                spilled[page_num] = (spill.tell(), len(data))
+                spill.write(data)
+            else:
+                waiting[page_num] = data
+            while next_page in waiting or next_page in spilled:
+                if next_page in waiting:
+                    data = waiting.pop(next_page)
+                else:
+                    offset, size = spilled.pop(next_page)
+                    spill.seek(offset)
+                    data = spill.read(size)
+                combined.write(data.strip())
+                combined.write(_PAGE_SEPARATOR)
+                next_page += 1
         
-        # Apply threshold to make text more distinct
-        threshold = 150
-        thresholded_image = enhanced_image.point(lambda p: p > threshold and 255)
+        def save_page(page_num, text, source="text"):
+            if text is None:
+                # Leave failed pages without a file, so a resumed run retries them
+                failed.append(page_num)
+                text = ""
+            elif per_page:
+                output_file = _write_page(output_dir, page_num, text)
+                print(f"Saved {source} from page {page_num}/{page_count} to {output_file}")
+            else:
+                print(f"Extracted {source} from page {page_num}/{page_count}")
+            if combined is not None:
+                combine_page(page_num, text.encode("utf-8"))
         
-        # Extract text using OCR
-        text = pytesseract.image_to_string(thresholded_image)
+        if len(pending) < page_count:
+            print(f"Skipping {page_count - len(pending)} pages already extracted to {output_dir}")
+            if combined is not None:
+                for page_num in sorted(set(range(1, page_count + 1)) - set(pending)):
+                    combine_page(page_num, _page_file(output_dir, page_num).read_bytes())
         
-        # Save text to file
-        output_file = output_dir / f"page_{page_num:03d}.txt"
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(text)
+        # Pages that already contain text don't need OCR
+        if use_text_layer and pending:
+            text_layer = _text_layer_pages(pdf_path, page_count)
+            for page_num in pending:
+                if page_num in text_layer:
+                    save_page(page_num, text_layer[page_num], source="embedded text")
+            pending = [page_num for page_num in pending if page_num not in text_layer]
         
-        print(f"Saved text from page {page_num} to {output_file}")
+        if pending:
+            _ocr_pages(pdf_path, pending, save_page)
     
-    print(f"Complete! Extracted text from {len(images)} pages to {output_dir}")
+    if combine_path:
+        print(f"Combined text saved to {combine_path}")
+    if failed:
+        print(f"Could not extract text from {len(failed)} pages: "
+              f"{', '.join(str(page_num) for page_num in sorted(failed))}. "
+              f"Run the extraction again to retry them.")
+    print(f"Complete! Extracted text from {page_count - len(failed)} pages to {output_dir}")
 
 
-def combine_text_files(output_dir, output_file="combined_text.txt"):
+def combine_text_files(output_dir, output_file=_COMBINED_FILE):
     """Combine all extracted text files into a single document."""
     output_dir = Path(output_dir)
     if not output_dir.exists() or not output_dir.is_dir():
@@ -125,30 +853,33 @@ def combine_text_files(output_dir, output_file="combined_text.txt"):
         return False
     
     # Get all text files and sort them by page number
-    text_files = sorted(output_dir.glob("page_*.txt"), 
-                        key=lambda x: int(x.stem.split('_')[1]))
+    pages = []
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            match = _PAGE_FILE_RE.match(entry.name)
+            if match:
+                pages.append((int(match.group(1)), entry.path))
+    pages.sort()
+    text_files = [path for _, path in pages]
     
     if not text_files:
         print(f"No text files found in {output_dir}")
         return False
     
-    # Combine all text files
-    combined_content = ""
-    for file_path in text_files:
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                
-                # Add page break marker for Word/Google Docs
-                combined_content += content + "\n\n" + "-" * 80 + "\n\n"
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}")
-    
-    # Write combined content to file
+    # Combine all text files, copying raw bytes so the text is never decoded
     combined_path = output_dir / output_file
     try:
-        with open(combined_path, "w", encoding="utf-8") as f:
-            f.write(combined_content)
+        with open(combined_path, "wb") as out:
+            for file_path in text_files:
+                try:
+                    with open(file_path, "rb") as f:
+                        content = f.read().strip()
+                except Exception as e:
+                    print(f"Error reading {file_path}: {e}")
+                    continue
+                
+                out.write(content)
+                out.write(_PAGE_SEPARATOR)
         print(f"Combined text saved to {combined_path}")
         return True
     except Exception as e:
@@ -161,9 +892,13 @@ def main():
     parser.add_argument('--pdf_path', dest='pdf_path', help='Path to the PDF file')
     parser.add_argument('--output_dir', dest='output_dir', help='Directory to save extracted text files')
     parser.add_argument('--combine', action='store_true',
-                      help='Combine extracted text files into a single document')
+                      help='Combine extracted text into a single document')
+    parser.add_argument('--per-page', action='store_true',
+                      help='With --combine, also save each page to its own text file')
     parser.add_argument('--skip-extraction', action='store_true',
                       help='Skip extraction and only combine existing text files')
+    parser.add_argument('--force-ocr', action='store_true',
+                      help='OCR every page, even pages that already contain text')
     args = parser.parse_args()
     
     # Validate arguments
@@ -195,17 +930,17 @@ def main():
     
     try:
         # Import module-level dependencies if needed
-        sys.path.insert(0, str(Path.home() / ".pdf_extractor_venv" / "lib" / f"python{sys.version_info.major}.{sys.version_info.minor}" / "site-packages"))
+        _add_venv_site_packages()
         
         # Extract text from PDF
         output_dir = args.output_dir
         print(f"Starting extraction process...")
-        extract_text_from_pdf(str(pdf_path), output_dir)
-        
-        # Combine text files if requested
-        if args.combine:
-            print(f"Combining extracted text files...")
-            combine_text_files(output_dir)
+        # Write the combined document during extraction if requested
+        combine_path = Path(output_dir) / _COMBINED_FILE if args.combine else None
+        extract_text_from_pdf(str(pdf_path), output_dir,
+                              use_text_layer=not args.force_ocr,
+                              combine_path=combine_path,
+                              per_page=args.per_page)
     except Exception as e:
         print(f"Error during extraction: {e}")
 